@@ -1,228 +1,598 @@
-import json
+import orjson
 import random
+import re
 import feedparser
 from datetime import datetime, timedelta
 from croniter import croniter
 import time
 import logging
-from typing import Optional, Dict, List, Any
-from pydantic import BaseModel, ValidationError
+from typing import Optional, Dict, List, Any, Tuple, Annotated
+import msgspec
 import asyncio
 import aiohttp
 import signal
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+import sqlite3
+import hashlib
+import uuid
+
+try:
+    from lxml import etree  # Fast C-backed XML parser, feedparser is the fallback
+except ImportError:
+    etree = None
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-class ConfigModel(BaseModel):
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+RSS1_NS = "{http://purl.org/rss/1.0/}"
+RDF_NS = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+SNIFF_BYTES = 1024  # How much of the document is inspected to detect the feed flavor
+NO_SUMMARY = "No summary available."
+MAX_ITEMS_PER_FEED = 50  # Only the most recent entries of each feed are considered
+SENT_RETENTION = 30 * 24 * 3600  # Sent articles older than this (in seconds) are forgotten
+USER_AGENT = "synapsebot/1.0 (+https://github.com/gscafo78/synapsebot)"
+FEED_TIMEOUT = aiohttp.ClientTimeout(total=10)  # A slow feed must not hold up the whole tick
+MATRIX_TIMEOUT = aiohttp.ClientTimeout(total=10)
+MATRIX_RETRIES = 3
+RETRY_STATUSES = {502, 503, 504}  # Transient gateway errors; safe to retry because sends are idempotent PUTs keyed by txn id
+SLEEP_SLICE = 30  # Max seconds between wall-clock checks while waiting for the next cron tick
+MAX_SKIPPED_TICKS = 10000  # Safety bound when looking for a tick outside the mute window
+
+class ConfigModel(msgspec.Struct, frozen=True):
     url_synapse: str
     port_synapse: int
     id_room: str
-    rss: List[str]
+    rss: Annotated[List[str], msgspec.Meta(min_length=1)]
     cron: str
     mute: Dict[str, str]
+    filters: List[str] = []  # Regular expressions, an article is kept if its title matches any
+    timezone: Optional[str] = None  # IANA name used for the schedule and mute window, local time if unset
+    token: Optional[str] = None
+
+def _sniff(head: bytes) -> Optional[str]:
+    """Detects the feed flavor from the beginning of the document."""
+    if b"<rdf:RDF" in head:
+        return 'rdf'
+    if b"<rss" in head:
+        return 'rss'
+    if b"<feed" in head:
+        return 'atom'
+    return None
+
+def _rss2_article(item) -> Dict[str, str]:
+    return {
+        'id': (item.findtext('guid') or '').strip(),
+        'title': (item.findtext('title') or '').strip(),
+        'link': (item.findtext('link') or '').strip(),
+        'summary': (item.findtext('description') or NO_SUMMARY).strip()
+    }
+
+def _rdf_article(item) -> Dict[str, str]:
+    return {
+        'id': item.get(f'{RDF_NS}about', ''),
+        'title': (item.findtext(f'{RSS1_NS}title') or '').strip(),
+        'link': (item.findtext(f'{RSS1_NS}link') or '').strip(),
+        'summary': (item.findtext(f'{RSS1_NS}description') or NO_SUMMARY).strip()
+    }
+
+def _atom_article(entry) -> Dict[str, str]:
+    link = ''
+    for link_el in entry.iterfind(f'{ATOM_NS}link'):
+        if link_el.get('rel', 'alternate') == 'alternate':
+            link = link_el.get('href', '')
+            break
+    summary = entry.findtext(f'{ATOM_NS}summary') or entry.findtext(f'{ATOM_NS}content') or NO_SUMMARY
+    return {
+        'id': (entry.findtext(f'{ATOM_NS}id') or '').strip(),
+        'title': (entry.findtext(f'{ATOM_NS}title') or '').strip(),
+        'link': link.strip(),
+        'summary': summary.strip()
+    }
+
+# Feed flavor -> (entry tag, entry to article converter)
+FEED_FLAVORS = {
+    'rss': ('item', _rss2_article),
+    'rdf': (f'{RSS1_NS}item', _rdf_article),
+    'atom': (f'{ATOM_NS}entry', _atom_article),
+}
 
 class RSSBot:
+    # Pre-encoded request bodies, only the JSON-encoded values are substituted
+    _SEND_TPL = b'{"msgtype":"m.text","body":%s}'
+    _READ_MARKERS_TPL = b'{"m.fully_read":%s,"m.read":%s}'
+    _MSG_TPL = "New article: {title}\n{link}"
+
     def __init__(self, config_file: str):
         self.config_file = config_file
-        self.rss_cache = {}  # Cache for RSS feeds
+        self.rss_cache_max = 64  # Max number of cached feeds
+        self._cache_file = config_file + ".cache"
+        self.rss_cache = self._load_cache()  # LRU cache for RSS feeds
         self.cache_expiry = timedelta(minutes=30)  # Cache expiration time
+        self._session: Optional[aiohttp.ClientSession] = None  # Shared HTTP connection pool
+        # Created in run(): before Python 3.10 they bind to the loop current at creation
+        self._fetch_semaphore: Optional[asyncio.Semaphore] = None  # Max concurrent feed downloads
+        self._send_semaphore: Optional[asyncio.Semaphore] = None  # Max concurrent background Matrix requests
+        self._bg = set()  # Strong references to the running background tasks
         try:
-            with open(config_file, 'r') as file:
-                config_data = json.load(file)
-            self.config = ConfigModel(**{k: v for k, v in config_data.items() if k != 'token'})
+            # Decode and validate in one pass, strict=False accepts e.g. the port as a string
+            with open(config_file, 'rb') as file:
+                self.config = msgspec.json.decode(file.read(), type=ConfigModel, strict=False)
             self.url_synapse = self.config.url_synapse
             self.port_synapse = self.config.port_synapse
             self.id_room = self.config.id_room
             self.rss_feeds = self.config.rss[:10]  # Limit to 10 RSS feeds
+            # Dedicated pool for feedparser, sized on the feeds so it never queues behind other work
+            self._parse_executor = ThreadPoolExecutor(max_workers=max(1, min(8, len(self.rss_feeds))), thread_name_prefix="feedparser")
             self.cron = self.config.cron
+            self.tz = ZoneInfo(self.config.timezone) if self.config.timezone else None
+            self._cron_iter = croniter(self.cron, datetime.now(self.tz))  # Parsed once, advanced on every run
+            # All the filters are merged into a single pattern so each title is scanned once
+            self._title_filter = re.compile("|".join(f"(?:{p})" for p in self.config.filters), re.IGNORECASE) if self.config.filters else None
             self.mute_from = self.config.mute.get('from')
             self.mute_to = self.config.mute.get('to')
+            try:
+                self._mute_from_t = datetime.strptime(self.mute_from, "%H:%M").time()
+                self._mute_to_t = datetime.strptime(self.mute_to, "%H:%M").time()
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid mute times {self.mute_from!r} - {self.mute_to!r}, expected HH:MM: {e}") from e
+
+            # The token and the Matrix endpoints never change, build them once
+            self._token = self.config.token
+            if not self._token:
+                logger.error("Token not found in config file.")
+            # Ensure the URL includes the protocol, http:// unless configured otherwise
+            url_synapse = self.url_synapse
+            if not url_synapse.startswith(("http://", "https://")):
+                url_synapse = "http://" + url_synapse
+            base_url = f"{url_synapse}:{self.port_synapse}/_matrix/client/r0"
+            self._send_url_prefix = f"{base_url}/rooms/{self.id_room}/send/m.room.message/"
+            self._read_markers_url = f"{base_url}/rooms/{self.id_room}/read_markers"
+            self._sync_url = f"{base_url}/sync"
+            self._headers = {
+                "Authorization": f"Bearer {self._token}",
+                "Content-Type": "application/json"
+            }
+
+            # Opened last so an invalid configuration leaves no store behind
+            self._sent_db = self._open_sent_db(config_file + ".sent.db")
+            self._seen = self._load_seen()  # Hash -> send time of the articles sent within SENT_RETENTION, oldest first
         except FileNotFoundError:
-            logger.error(f"Configuration file '{config_file}' not found.")
+            logger.error("Configuration file '%s' not found.", config_file)
             raise
-        except json.JSONDecodeError:
-            logger.error(f"Error parsing the JSON file '{config_file}'. Check the syntax.")
+        except msgspec.ValidationError as e:
+            logger.error("Configuration validation error: %s", e)
             raise
-        except ValidationError as e:
-            logger.error(f"Configuration validation error: {e}")
+        except msgspec.DecodeError:
+            logger.error("Error parsing the JSON file '%s'. Check the syntax.", config_file)
             raise
         except Exception as e:
-            logger.error(f"Error during bot initialization: {e}")
+            logger.error("Error during bot initialization: %s", e)
             raise
 
-    def _read_token(self) -> Optional[str]:
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """Returns the shared HTTP session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            # Cap per-host connections so concurrent fetches don't hammer a single feed host
+            connector = aiohttp.TCPConnector(limit=64, limit_per_host=4, use_dns_cache=True,
+                                             ttl_dns_cache=300, keepalive_timeout=75)
+            self._session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+        return self._session
+
+    def _spawn(self, coro) -> None:
+        """Runs a coroutine in the background, bounded by the send semaphore."""
+        async def bounded():
+            async with self._send_semaphore:
+                return await coro
+
+        task = asyncio.create_task(bounded())
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+
+    async def _fetch_feed(self, session: aiohttp.ClientSession, feed_url: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Downloads and parses a single RSS feed, returning its cache entry or None on failure."""
+        # Conditional GET: unchanged feeds answer 304 and the cached articles are reused
+        cached = self.rss_cache.get(feed_url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        async with self._fetch_semaphore:
+            try:
+                async with session.get(feed_url, headers=headers, timeout=FEED_TIMEOUT) as response:
+                    if response.status == 304 and cached:
+                        return feed_url, {'articles': cached['articles'], 'etag': cached.get('etag'), 'last_modified': cached.get('last_modified')}
+                    if response.status != 200:
+                        logger.warning("Failed to fetch %s: %s", feed_url, response.status)
+                        return feed_url, None
+                    validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+                    if etree is not None:
+                        articles, head = await self._stream_articles(feed_url, response)
+                        if articles is not None:
+                            return feed_url, {'articles': articles, **validators}
+                        # Nothing recognised while streaming, let feedparser handle the whole document
+                        body = head + await response.content.read()
+                    else:
+                        body = await response.read()
+            except Exception as e:
+                logger.error("Error fetching the feed %s: %s", feed_url, e)
+                return feed_url, None
+
+        # feedparser is CPU bound, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        articles = await loop.run_in_executor(self._parse_executor, self._parse_feed, feed_url, body)
+        return feed_url, None if articles is None else {'articles': articles, **validators}
+
+    async def _stream_articles(self, feed_url: str, response: aiohttp.ClientResponse) -> Tuple[Optional[List[Dict[str, str]]], bytes]:
+        """Parses the response incrementally, stopping after MAX_ITEMS_PER_FEED entries.
+
+        Returns the articles found, or None and the raw bytes consumed so far
+        when the document has to be handed to feedparser. A syntax error after
+        some entries were parsed keeps those entries rather than falling back.
+        """
+        parser = to_article = None
+        articles = []
+        head = bytearray()
         try:
-            with open(self.config_file, 'r') as file:
-                config_data = json.load(file)
-                return config_data.get('token')
+            async for chunk in response.content.iter_chunked(16384):
+                if not articles:
+                    head += chunk
+                if parser is None:
+                    # Pick the parser for this flavor only, unknown formats go to feedparser
+                    flavor = _sniff(bytes(head[:SNIFF_BYTES]))
+                    if flavor is None:
+                        if len(head) < SNIFF_BYTES:
+                            continue
+                        return None, bytes(head)
+                    tag, to_article = FEED_FLAVORS[flavor]
+                    parser = etree.XMLPullParser(events=('end',), tag=tag, recover=True, huge_tree=False)
+                    chunk = bytes(head)
+                parser.feed(chunk)
+                for _, element in parser.read_events():
+                    article = to_article(element)
+                    if article['link']:  # Entries without a link cannot be posted nor deduplicated
+                        articles.append(article)
+                    # Drop the consumed node and its siblings so memory stays flat
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    if len(articles) >= MAX_ITEMS_PER_FEED:
+                        return articles, b''
+        except etree.XMLSyntaxError as e:
+            # head stops growing at the first article, so it only holds the whole prefix while none was found
+            if articles:
+                logger.warning("lxml stopped parsing %s after %d entries: %s", feed_url, len(articles), e)
+                return articles, b''
+            logger.warning("lxml could not parse %s, falling back to feedparser: %s", feed_url, e)
+            return None, bytes(head)
+        return (articles, b'') if articles else (None, bytes(head))
+
+    def _accept(self, article: Dict[str, str]) -> bool:
+        """Tells whether the article title matches the configured filters, if any."""
+        return self._title_filter is None or self._title_filter.search(article['title']) is not None
+
+    def _parse_feed(self, feed_url: str, body: bytes) -> Optional[List[Dict[str, str]]]:
+        """Extracts the articles from a whole feed document with feedparser."""
+        try:
+            feed = feedparser.parse(body)
+            if feed.bozo:
+                logger.warning("Error parsing the RSS feed: %s. Error: %s", feed_url, feed.bozo_exception)
+                return None
+            return [{
+                'id': entry.get('id', ''),
+                'title': entry.title,
+                'link': entry.link,
+                'summary': entry.summary if hasattr(entry, 'summary') else NO_SUMMARY
+            } for entry in feed.entries if entry.get('link')][:MAX_ITEMS_PER_FEED]
         except Exception as e:
-            logger.error(f"Error reading token from config file: {e}")
+            logger.error("Error parsing the feed %s: %s", feed_url, e)
             return None
 
     async def fetch_random_article(self) -> Optional[Dict[str, str]]:
-        articles = []
+        feed_articles = []  # One list per feed, referenced from the cache rather than copied
         now = datetime.now()
-        async with aiohttp.ClientSession() as session:
-            for feed_url in self.rss_feeds:
-                if feed_url in self.rss_cache and now - self.rss_cache[feed_url]['timestamp'] < self.cache_expiry:
-                    articles.extend(self.rss_cache[feed_url]['articles'])
-                    continue
+        session = await self._ensure_session()
+        stale_feeds = []
+        for feed_url in self.rss_feeds:
+            if feed_url in self.rss_cache and now - self.rss_cache[feed_url]['timestamp'] < self.cache_expiry:
+                self.rss_cache.move_to_end(feed_url)
+                feed_articles.append(self.rss_cache[feed_url]['articles'])
+            else:
+                stale_feeds.append(feed_url)
+
+        # Download and parse all the expired feeds concurrently
+        results = await asyncio.gather(*(self._fetch_feed(session, u) for u in stale_feeds), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error("Error fetching a feed: %s", result)
+                continue
+            feed_url, entry = result
+            if entry is None:
+                continue
+            self.rss_cache[feed_url] = {'timestamp': now, **entry}
+            self.rss_cache.move_to_end(feed_url)
+            while len(self.rss_cache) > self.rss_cache_max:
+                self.rss_cache.popitem(last=False)
+            feed_articles.append(entry['articles'])
+
+        if stale_feeds:
+            self._save_cache()
+        return self._pick_random(feed_articles)
+
+    def _load_cache(self) -> OrderedDict:
+        """Loads the feeds cached by a previous run.
+
+        Entries are marked as expired so they are revalidated with a conditional GET.
+        """
+        cache = OrderedDict()
+        try:
+            with open(self._cache_file, 'rb') as file:
+                for feed_url, entry in orjson.loads(file.read()).items():
+                    cache[feed_url] = {**entry, 'timestamp': datetime.min}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Error reading the feed cache from '%s': %s", self._cache_file, e)
+        while len(cache) > self.rss_cache_max:
+            cache.popitem(last=False)
+        return cache
 
-                try:
-                    async with session.get(feed_url) as response:
-                        if response.status == 200:
-                            feed = feedparser.parse(await response.text())
-                            if feed.bozo:
-                                logger.warning(f"Error parsing the RSS feed: {feed_url}. Error: {feed.bozo_exception}")
-                                continue
-                            feed_articles = []
-                            for entry in feed.entries:
-                                feed_articles.append({
-                                    'title': entry.title,
-                                    'link': entry.link,
-                                    'summary': entry.summary if hasattr(entry, 'summary') else "No summary available."
-                                })
-                            self.rss_cache[feed_url] = {'timestamp': now, 'articles': feed_articles}
-                            articles.extend(feed_articles)
-                        else:
-                            logger.warning(f"Failed to fetch {feed_url}: {response.status}")
-                except Exception as e:
-                    logger.error(f"Error fetching the feed {feed_url}: {e}")
+    def _save_cache(self) -> None:
+        """Persists articles and validators of the cached feeds across restarts."""
+        data = {
+            feed_url: {'articles': entry['articles'], 'etag': entry.get('etag'), 'last_modified': entry.get('last_modified')}
+            for feed_url, entry in self.rss_cache.items()
+        }
+        try:
+            with open(self._cache_file, 'wb') as file:
+                file.write(orjson.dumps(data))
+        except OSError as e:
+            logger.warning("Error saving the feed cache to '%s': %s", self._cache_file, e)
+
+    @staticmethod
+    def _article_hash(article: Dict[str, str]) -> bytes:
+        """Identifies an article by its GUID/id, or by its link when the feed has none."""
+        return hashlib.sha256((article.get('id') or article['link']).encode()).digest()
+
+    @staticmethod
+    def _article_hashes(article: Dict[str, str]) -> List[bytes]:
+        """Hashes of both the link and the GUID/id: syndicated copies share the link but not the id."""
+        keys = {article['link'], article.get('id') or article['link']}
+        return [hashlib.sha256(key.encode()).digest() for key in keys if key]
+
+    def _pick_random(self, feed_articles: List[List[Dict[str, str]]]) -> Optional[Dict[str, str]]:
+        """Picks one article uniformly among the distinct articles passing the filters and not sent yet.
+
+        Uses single-item reservoir sampling, so the per-feed lists are never concatenated.
+        Filters are applied here rather than when caching, so a change of 'filters'
+        also applies to feeds served from the cache.
+        """
+        chosen = None
+        candidates = 0
+        links = set()  # Articles syndicated by several feeds only count once
+        for articles in feed_articles:
+            for article in articles:
+                link = article['link']
+                # Link-less entries may still come from a cache written by an older version
+                if not link or link in links or not self._accept(article) or any(self._is_seen(h) for h in self._article_hashes(article)):
                     continue
+                links.add(link)
+                candidates += 1
+                if random.randrange(candidates) == 0:
+                    chosen = article
+        return chosen
+
+    @staticmethod
+    def _open_sent_db(path: str) -> sqlite3.Connection:
+        """Opens the store of sent articles, falling back to memory if the file is not usable."""
+        try:
+            db = sqlite3.connect(path, isolation_level=None)
+            db.execute("CREATE TABLE IF NOT EXISTS sent(h BLOB PRIMARY KEY, ts INT)")
+        except sqlite3.Error as e:
+            logger.warning("Error opening the sent articles store '%s', using memory: %s", path, e)
+            db = sqlite3.connect(":memory:", isolation_level=None)
+            db.execute("CREATE TABLE sent(h BLOB PRIMARY KEY, ts INT)")
+        db.execute("CREATE INDEX IF NOT EXISTS sent_ts ON sent(ts)")  # Keeps the periodic pruning cheap
+        return db
+
+    def _prune_sent(self) -> None:
+        """Forgets the articles sent more than SENT_RETENTION seconds ago, in memory and in the store."""
+        cutoff = int(time.time()) - SENT_RETENTION
+        while self._seen:
+            h, ts = next(iter(self._seen.items()))
+            if ts >= cutoff:
+                break
+            del self._seen[h]
+        try:
+            self._sent_db.execute("DELETE FROM sent WHERE ts < ?", (cutoff,))
+        except sqlite3.Error as e:
+            logger.warning("Error pruning the sent articles: %s", e)
 
-        return random.choice(articles) if articles else None
+    def _load_seen(self) -> OrderedDict:
+        """Loads every article sent in the last SENT_RETENTION seconds.
 
-    async def send_message(self, message: str) -> bool:
-        token = self._read_token()
-        if not token:
+        Lookups are then answered from memory only, the store is just written to.
+        """
+        try:
+            rows = self._sent_db.execute("SELECT h, ts FROM sent WHERE ts >= ? ORDER BY ts",
+                                         (int(time.time()) - SENT_RETENTION,)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Error reading the sent articles: %s", e)
+            rows = []
+        return OrderedDict(rows)
+
+    def _is_seen(self, h: bytes) -> bool:
+        """Tells whether an article hash was sent within SENT_RETENTION."""
+        return h in self._seen
+
+    def _mark_seen(self, article: Dict[str, str]) -> None:
+        """Remembers a sent article and records it in the store."""
+        hashes = self._article_hashes(article)
+        now = int(time.time())
+        for h in hashes:
+            self._seen[h] = now
+            self._seen.move_to_end(h)
+        try:
+            self._sent_db.executemany("INSERT OR REPLACE INTO sent(h, ts) VALUES (?, ?)", [(h, now) for h in hashes])
+        except sqlite3.Error as e:
+            logger.warning("Error saving the sent article: %s", e)
+
+    async def _request(self, method: str, url: str, data: bytes) -> None:
+        """Calls the homeserver, retrying transient failures with exponential backoff."""
+        session = await self._ensure_session()
+        for attempt in range(MATRIX_RETRIES + 1):
+            last_attempt = attempt == MATRIX_RETRIES
+            try:
+                async with session.request(method, url, headers=self._headers, data=data, timeout=MATRIX_TIMEOUT) as response:
+                    if last_attempt or response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return
+                    logger.warning("Homeserver answered %s, retrying...", response.status)
+            except aiohttp.ClientConnectorError as e:
+                if last_attempt:
+                    raise
+                logger.warning("Cannot connect to the homeserver, retrying: %s", e)
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def send_message(self, message: str, txn_id: Optional[str] = None) -> bool:
+        """Sends a text message; reusing a txn_id lets the homeserver drop duplicates."""
+        if not self._token:
             logger.error("Token not found in config file.")
             return False
 
-        url = f"http://{self.url_synapse}:{self.port_synapse}/_matrix/client/r0/rooms/{self.id_room}/send/m.room.message"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "msgtype": "m.text",
-            "body": message
-        }
+        data = self._SEND_TPL % orjson.dumps(message)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    response.raise_for_status()
-                    logger.info(f"Message sent successfully: {message}")
-                    return True
-        except aiohttp.ClientError as e:
-            logger.error(f"Error sending the message: {e}")
+            await self._request('PUT', self._send_url_prefix + (txn_id or uuid.uuid4().hex), data)
+            logger.info("Message sent successfully: %s", message)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error sending the message: %s", e)
             return False
 
     async def mark_message_as_read(self, event_id: str) -> bool:
-        token = self._read_token()
-        if not token:
+        """Moves the read markers to event_id, marking it and every earlier message as read."""
+        if not self._token:
             logger.error("Token not found in config file.")
             return False
 
-        url = f"http://{self.url_synapse}:{self.port_synapse}/_matrix/client/r0/rooms/{self.id_room}/receipt/m.read/{event_id}"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "m.read": {
-                "event_id": event_id
-            }
-        }
+        encoded_id = orjson.dumps(event_id)
+        data = self._READ_MARKERS_TPL % (encoded_id, encoded_id)
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    response.raise_for_status()
-                    logger.info(f"Message {event_id} marked as read.")
-                    return True
-        except aiohttp.ClientError as e:
-            logger.error(f"Error marking message as read: {e}")
+            await self._request('POST', self._read_markers_url, data)
+            logger.info("Messages up to %s marked as read.", event_id)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error marking message as read: %s", e)
             return False
 
     async def listen_for_events(self):
-        token = self._read_token()
-        if not token:
+        if not self._token:
             logger.error("Token not found in config file.")
             return
 
-        url = f"http://{self.url_synapse}:{self.port_synapse}/_matrix/client/r0/sync"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-
-        filter = json.dumps({
+        filter = orjson.dumps({
             "room": {
                 "timeline": {
                     "limit": 5  # Reduced the number of requested events
                 }
             }
-        })
+        }).decode()
         params = {
-            "filter": filter
+            "filter": filter,
+            "timeout": "30000"  # Long-poll: the server holds the request until an event arrives
         }
+        sync_timeout = aiohttp.ClientTimeout(total=40)  # Must outlast the server-side timeout
 
         backoff = 1  # Initial backoff in seconds
 
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers, params=params) as response:
-                        response.raise_for_status()
-                        data = await response.json()
-
-                        next_batch = data.get("next_batch")
-                        if next_batch:
-                            params["since"] = next_batch
-
-                        if "rooms" in data and "join" in data["rooms"]:
-                            room_events = data["rooms"]["join"].get(self.id_room, {}).get("timeline", {}).get("events", [])
-                            for event in room_events:
-                                if event["type"] == "m.room.message":
-                                    await self.mark_message_as_read(event["event_id"])
-                                elif event["type"] == "m.room.member" and event["content"]["membership"] == "join":
-                                    user_id = event["state_key"]
-                                    welcome_message = f"Welcome to the room, {user_id}!"
-                                    # user_name = user_id.split(":")[0]  # Extract the part before the colon
-                                    # welcome_message = f"Welcome to the room, {user_name}!"
-                                    await self.send_message(welcome_message)
-
-
-
-                        backoff = 1  # Reset backoff after a successful request
-            except aiohttp.ClientError as e:
-                logger.error(f"Error listening for events: {e}")
+                session = await self._ensure_session()
+                async with session.get(self._sync_url, headers=self._headers, params=params, timeout=sync_timeout) as response:
+                    response.raise_for_status()
+                    data = orjson.loads(await response.read())
+
+                    next_batch = data.get("next_batch")
+                    if next_batch:
+                        params["since"] = next_batch
+
+                    if "rooms" in data and "join" in data["rooms"]:
+                        room_events = data["rooms"]["join"].get(self.id_room, {}).get("timeline", {}).get("events", [])
+                        last_message_id = None
+                        for event in room_events:
+                            if event["type"] == "m.room.message":
+                                last_message_id = event["event_id"]
+                            elif event["type"] == "m.room.member" and event["content"]["membership"] == "join":
+                                user_id = event["state_key"]
+                                welcome_message = f"Welcome to the room, {user_id}!"
+                                # user_name = user_id.split(":")[0]  # Extract the part before the colon
+                                # welcome_message = f"Welcome to the room, {user_name}!"
+                                self._spawn(self.send_message(welcome_message))
+
+                        # One read marker update covers every message in the batch
+                        if last_message_id:
+                            self._spawn(self.mark_message_as_read(last_message_id))
+
+                    backoff = 1  # Reset backoff after a successful request
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error("Error listening for events: %s", e)
                 await asyncio.sleep(backoff)
                 backoff = min(backoff * 2, 60)  # Exponentially increase backoff, max 60 seconds
-            await asyncio.sleep(60)  # Added a delay to reduce CPU usage
 
-    def is_mute_time(self) -> bool:
-        try:
-            now = datetime.now().time()
-            mute_from = datetime.strptime(self.mute_from, "%H:%M").time()
-            mute_to = datetime.strptime(self.mute_to, "%H:%M").time()
+    def is_mute_time(self, now: Optional[datetime] = None) -> bool:
+        if now is None:
+            now = datetime.now(self.tz)
+        return self._in_mute_window(now.time())
 
-            if mute_from < mute_to:
-                return mute_from <= now <= mute_to
-            else:
-                return now >= mute_from or now <= mute_to
-        except ValueError as e:
-            logger.error(f"Error parsing mute times: {e}")
-            return False
-
-    async def job(self):
-        if not self.is_mute_time():
+    def _in_mute_window(self, t, end_inclusive: bool = True) -> bool:
+        mute_from, mute_to = self._mute_from_t, self._mute_to_t
+        before_end = t <= mute_to if end_inclusive else t < mute_to
+        if mute_from < mute_to:
+            return mute_from <= t and before_end
+        else:
+            return t >= mute_from or before_end
+
+    def _next_fire(self, now: Optional[datetime] = None) -> datetime:
+        """Advances the cron schedule to the next future tick outside the mute window.
+
+        Ticks that elapsed while the previous job was running are skipped too.
+        If every tick within MAX_SKIPPED_TICKS is muted, the first future one is returned.
+        """
+        if now is None:
+            now = datetime.now(self.tz)
+        first_future = None
+        for _ in range(MAX_SKIPPED_TICKS):
+            next_run = self._cron_iter.get_next(datetime)
+            if next_run <= now:
+                continue
+            # job() checks the window a moment after the tick, so a tick on mute_to already sends
+            if not self._in_mute_window(next_run.time(), end_inclusive=False):
+                return next_run
+            if first_future is None:
+                first_future = next_run
+        if first_future is None:
+            return next_run
+        self._cron_iter.set_current(first_future, force=True)
+        return first_future
+
+    async def job(self, now: Optional[datetime] = None):
+        if not self.is_mute_time(now):
+            self._prune_sent()  # Ages out old articles, also on long-running bots that rarely send
             article = await self.fetch_random_article()
             if article:
-                message = f"New article: {article['title']}\n{article['link']}"
-                if not await self.send_message(message):
+                message = self._MSG_TPL.format_map(article)
+                # Derived from the article, so a resend after a crash is deduplicated by Synapse
+                txn_id = self._article_hash(article).hex()[:32]
+                if await self.send_message(message, txn_id):
+                    self._mark_seen(article)
+                else:
                     logger.warning("Message sending failed.")
             else:
                 logger.info("No articles found.")
@@ -231,31 +601,36 @@ class RSSBot:
 
     async def run(self):
         try:
-            base_time = datetime.now()
-            cron = self.cron
-
+            self._fetch_semaphore = asyncio.Semaphore(8)
+            self._send_semaphore = asyncio.Semaphore(8)
             task_listen = asyncio.create_task(self.listen_for_events())
 
             while True:
-                iter_cron = croniter(cron, base_time)
-                next_run = iter_cron.get_next(datetime)
+                # Sleep straight through the mute window instead of waking up for every tick
+                next_run = self._next_fire()
 
-                sleep_time = (next_run - datetime.now()).total_seconds()
-                logger.info(f"Next execution at {next_run}. Sleeping for {sleep_time} seconds.")
+                next_ts = next_run.timestamp()
+                sleep_time = max(0.0, next_ts - time.time())
+                logger.info("Next execution at %s. Sleeping for %s seconds.", next_run, sleep_time)
 
-                if sleep_time > 0:
-                    await asyncio.sleep(sleep_time)
+                # asyncio.sleep runs on the monotonic clock: wake up periodically to
+                # re-check the wall clock, so NTP corrections neither skip nor repeat a tick
+                while (sleep_time := next_ts - time.time()) > 0:
+                    await asyncio.sleep(min(sleep_time, SLEEP_SLICE))
 
-                await self.job()
-                base_time = datetime.now()
+                await self.job(datetime.now(self.tz))
         except KeyboardInterrupt:
             logger.info("Bot manually interrupted. Cleaning up...")
         except Exception as e:
-            logger.error(f"Unexpected error during bot execution: {e}")
+            logger.error("Unexpected error during bot execution: %s", e)
         finally:
             logger.info("Cancelling all running tasks...")
             tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
             [task.cancel() for task in tasks]
+            if self._session is not None:
+                await self._session.close()
+            self._parse_executor.shutdown(wait=False, cancel_futures=True)
+            self._sent_db.close()
 
             logger.info("Bot stopped.")
 
@@ -271,4 +646,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Bot terminated by user.")
     except Exception as e:
-        logger.error(f"Critical error during bot startup: {e}")
+        logger.error("Critical error during bot startup: %s", e)
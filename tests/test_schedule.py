@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+import orjson
+from croniter import croniter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from rssbot import RSSBot  # noqa: E402
+
+
+class NextFireTest(unittest.TestCase):
+    def make_bot(self, cron: str, mute_from: str, mute_to: str, start: datetime) -> RSSBot:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        config_file = os.path.join(tmp.name, "settings.json")
+        with open(config_file, 'wb') as file:
+            file.write(orjson.dumps({
+                "token": "token", "url_synapse": "127.0.0.1", "port_synapse": 8008, "id_room": "room",
+                "rss": ["http://example.com/feed"], "cron": cron,
+                "mute": {"from": mute_from, "to": mute_to},
+            }))
+        bot = RSSBot(config_file)
+        self.addCleanup(bot._sent_db.close)
+        self.addCleanup(bot._parse_executor.shutdown)
+        bot._cron_iter = croniter(cron, start)
+        return bot
+
+    def test_tick_on_mute_end_fires(self):
+        now = datetime(2025, 3, 10, 7, 30)
+        bot = self.make_bot("0 * * * *", "20:00", "08:00", now)
+        next_run = bot._next_fire(now)
+        self.assertEqual(next_run, datetime(2025, 3, 10, 8, 0))
+        self.assertFalse(bot.is_mute_time(next_run.replace(microsecond=3000)))
+
+    def test_daily_tick_on_mute_end_fires(self):
+        now = datetime(2025, 3, 10, 9, 0)
+        bot = self.make_bot("0 8 * * *", "20:00", "08:00", now)
+        self.assertEqual(bot._next_fire(now), datetime(2025, 3, 11, 8, 0))
+
+    def test_tick_on_mute_start_is_skipped(self):
+        now = datetime(2025, 3, 10, 19, 30)
+        bot = self.make_bot("0 * * * *", "20:00", "08:00", now)
+        self.assertEqual(bot._next_fire(now), datetime(2025, 3, 11, 8, 0))
+
+    def test_all_ticks_muted_falls_back_to_first_future_tick(self):
+        now = datetime(2025, 3, 10, 9, 30)
+        bot = self.make_bot("0 * * * *", "03:00", "03:00", now)  # Muted all day
+        self.assertEqual(bot._next_fire(now), datetime(2025, 3, 10, 10, 0))
+        self.assertEqual(bot._next_fire(now), datetime(2025, 3, 10, 11, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()